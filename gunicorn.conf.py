@@ -0,0 +1,15 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+# Job, rate-limit and single-flight state live in per-process dicts, so
+# the API only behaves correctly with one web worker: a second worker
+# would 404 on jobs it didn't create and multiply the rate limit.
+# Download parallelism comes from the yt-dlp subprocess pool, and the
+# threads below keep polling/SSE clients concurrent.
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get('WEB_THREADS', '16'))
+timeout = 600  # Downloads can take minutes
+# No max_requests recycling: restarting the lone worker would drop all
+# tracked jobs and kill in-flight downloads, and job polling plus
+# /health checks alone would burn through any request budget.
@@ -1,266 +1,765 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from yt_dlp import YoutubeDL
-import os
-import logging
-import threading
-import time
-import glob
-from datetime import datetime, timedelta
-import hashlib
-
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger("youtube-downloader")
-
-# Use Railway's persistent storage
-DOWNLOAD_DIR = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH', '/data')
-MAX_FILE_AGE_HOURS = int(os.environ.get('MAX_FILE_AGE_HOURS', '24'))  # Clean files older than 24 hours
-MAX_DURATION_SECONDS = int(os.environ.get('MAX_DURATION_SECONDS', '3600'))  # 1 hour default
-
-# Simple in-memory rate limiting (for basic protection)
-download_requests = {}
-MAX_REQUESTS_PER_IP = int(os.environ.get('MAX_REQUESTS_PER_IP', '10'))
-RATE_LIMIT_WINDOW_MINUTES = int(os.environ.get('RATE_LIMIT_WINDOW_MINUTES', '60'))
-
-def cleanup_old_files():
-    """Clean up files older than MAX_FILE_AGE_HOURS"""
-    try:
-        if not os.path.exists(DOWNLOAD_DIR):
-            return
-        
-        cutoff_time = datetime.now() - timedelta(hours=MAX_FILE_AGE_HOURS)
-        pattern = os.path.join(DOWNLOAD_DIR, "*")
-        
-        for file_path in glob.glob(pattern):
-            if os.path.isfile(file_path):
-                file_time = datetime.fromtimestamp(os.path.getctime(file_path))
-                if file_time < cutoff_time:
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Cleaned up old file: {file_path}")
-                    except Exception as e:
-                        logger.error(f"Failed to remove file {file_path}: {e}")
-    except Exception as e:
-        logger.error(f"Error during cleanup: {e}")
-
-def start_cleanup_thread():
-    """Start background thread for periodic cleanup"""
-    def cleanup_worker():
-        while True:
-            cleanup_old_files()
-            time.sleep(3600)  # Run every hour
-    
-    cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-    cleanup_thread.start()
-    logger.info("Started cleanup background thread")
-
-def check_rate_limit(client_ip):
-    """Simple rate limiting check"""
-    current_time = datetime.now()
-    
-    # Clean old entries
-    cutoff_time = current_time - timedelta(minutes=RATE_LIMIT_WINDOW_MINUTES)
-    download_requests[client_ip] = [
-        req_time for req_time in download_requests.get(client_ip, [])
-        if req_time > cutoff_time
-    ]
-    
-    # Check if limit exceeded
-    if len(download_requests.get(client_ip, [])) >= MAX_REQUESTS_PER_IP:
-        return False
-    
-    # Add current request
-    if client_ip not in download_requests:
-        download_requests[client_ip] = []
-    download_requests[client_ip].append(current_time)
-    
-    return True
-
-def get_safe_filename(title):
-    """Generate a safe filename from video title"""
-    # Remove or replace problematic characters
-    safe_chars = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_. "
-    safe_title = ''.join(c if c in safe_chars else '_' for c in title)
-    # Limit length and remove extra spaces
-    safe_title = ' '.join(safe_title.split())[:100]
-    return safe_title
-
-# Health check endpoint
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({
-        "status": "healthy", 
-        "service": "youtube-downloader",
-        "timestamp": datetime.now().isoformat(),
-        "download_dir": DOWNLOAD_DIR,
-        "max_duration": MAX_DURATION_SECONDS
-    })
-
-# Root endpoint with documentation
-@app.route('/', methods=['GET'])
-def home():
-    return jsonify({
-        "message": "YouTube Downloader API",
-        "version": "1.1.0",
-        "endpoints": {
-            "GET /health": "Health check",
-            "POST /download": "Download YouTube video",
-            "GET /status": "Service status and configuration"
-        },
-        "limits": {
-            "max_duration_seconds": MAX_DURATION_SECONDS,
-            "max_requests_per_ip": MAX_REQUESTS_PER_IP,
-            "rate_limit_window_minutes": RATE_LIMIT_WINDOW_MINUTES
-        }
-    })
-
-# Status endpoint
-@app.route('/status', methods=['GET'])
-def status():
-    try:
-        disk_usage = os.statvfs(DOWNLOAD_DIR) if os.path.exists(DOWNLOAD_DIR) else None
-        file_count = len(glob.glob(os.path.join(DOWNLOAD_DIR, "*"))) if os.path.exists(DOWNLOAD_DIR) else 0
-        
-        return jsonify({
-            "service": "youtube-downloader",
-            "status": "running",
-            "download_directory": DOWNLOAD_DIR,
-            "file_count": file_count,
-            "disk_usage": {
-                "total_bytes": disk_usage.f_frsize * disk_usage.f_blocks if disk_usage else None,
-                "free_bytes": disk_usage.f_frsize * disk_usage.f_bavail if disk_usage else None
-            } if disk_usage else None,
-            "configuration": {
-                "max_duration_seconds": MAX_DURATION_SECONDS,
-                "max_file_age_hours": MAX_FILE_AGE_HOURS,
-                "max_requests_per_ip": MAX_REQUESTS_PER_IP,
-                "rate_limit_window_minutes": RATE_LIMIT_WINDOW_MINUTES
-            }
-        })
-    except Exception as e:
-        logger.error(f"Status check failed: {e}")
-        return jsonify({"error": "Status check failed", "details": str(e)}), 500
-
-# Download endpoint
-@app.route('/download', methods=['POST'])
-def download_video():
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    
-    # Rate limiting check
-    if not check_rate_limit(client_ip):
-        logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-        return jsonify({
-            "error": "Rate limit exceeded",
-            "message": f"Maximum {MAX_REQUESTS_PER_IP} requests per {RATE_LIMIT_WINDOW_MINUTES} minutes"
-        }), 429
-    
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Invalid JSON data"}), 400
-        
-    url = data.get("url")
-    if not url:
-        logger.error("No URL provided")
-        return jsonify({"error": "No URL provided"}), 400
-
-    # Basic URL validation
-    if not (url.startswith('http://') or url.startswith('https://')):
-        return jsonify({"error": "Invalid URL format"}), 400
-
-    try:
-        # Create download directory
-        os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-        logger.info(f"Download directory: {DOWNLOAD_DIR}")
-        
-        # Get video info first to check duration and validate
-        ydl_info_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extractaudio': False,
-            'noplaylist': True,
-        }
-        
-        with YoutubeDL(ydl_info_opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=False)
-            except Exception as e:
-                logger.error(f"Failed to extract video info: {e}")
-                return jsonify({
-                    "error": "Failed to extract video information",
-                    "details": "Invalid URL or video not accessible"
-                }), 400
-            
-            duration = info.get('duration', 0)
-            title = info.get('title', 'Unknown')
-            uploader = info.get('uploader', 'Unknown')
-            
-            logger.info(f"Video found: {title} by {uploader}, Duration: {duration}s")
-            
-            # Duration limit check
-            if duration and duration > MAX_DURATION_SECONDS:
-                logger.warning(f"Video too long: {duration}s")
-                return jsonify({
-                    "error": "Video exceeds maximum duration",
-                    "max_duration_seconds": MAX_DURATION_SECONDS,
-                    "video_duration_seconds": duration
-                }), 400
-        
-        # Generate safe filename
-        safe_title = get_safe_filename(title)
-        
-        # Download the video
-        ydl_opts = {
-            'outtmpl': f'{DOWNLOAD_DIR}/{safe_title}.%(ext)s',
-            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-            'extractaudio': False,
-            'writeinfojson': False,
-            'writethumbnail': False,
-        }
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                logger.info(f"Download complete: {filename}")
-            except Exception as e:
-                logger.error(f"Download failed during extraction: {e}")
-                return jsonify({
-                    "error": "Download failed",
-                    "details": "Failed to download video file"
-                }), 500
-
-        # Generate response
-        response_data = {
-            "title": title,
-            "uploader": uploader,
-            "filename": os.path.basename(filename),
-            "duration": duration,
-            "status": "Downloaded successfully",
-            "download_time": datetime.now().isoformat(),
-            "file_size_bytes": os.path.getsize(filename) if os.path.exists(filename) else None
-        }
-        
-        logger.info(f"Successfully downloaded: {title}")
-        return jsonify(response_data)
-
-    except Exception as e:
-        logger.error(f"Unexpected error during download: {str(e)}")
-        return jsonify({
-            "error": "Internal server error", 
-            "details": "An unexpected error occurred during download"
-        }), 500
-
-# Initialize cleanup thread when app starts
-start_cleanup_thread()
-
-if __name__ == '__main__':
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
-
+from flask import Flask, Response, request, jsonify, send_from_directory
+from flask.json.provider import JSONProvider
+from flask_cors import CORS
+from yt_dlp import YoutubeDL
+import orjson
+import atexit
+import fcntl
+import itertools
+import os
+import queue
+import logging
+import re
+import threading
+import time
+import uuid
+import multiprocessing as mp
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+import hashlib
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson's C serializer"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app = Flask(__name__)
+app.json = OrjsonProvider(app)
+CORS(app)  # Enable CORS for all routes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("youtube-downloader")
+
+# Use Railway's persistent storage; created once here so request
+# handlers don't re-stat the directory on every download
+DOWNLOAD_DIR = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH', '/data')
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+MAX_FILE_AGE_HOURS = int(os.environ.get('MAX_FILE_AGE_HOURS', '24'))  # Clean files older than 24 hours
+MAX_DURATION_SECONDS = int(os.environ.get('MAX_DURATION_SECONDS', '3600'))  # 1 hour default
+
+# Simple in-memory rate limiting (for basic protection)
+# Maps client IP -> [request_count, window_start], LRU-ordered so the
+# oldest-seen IP can be evicted once MAX_TRACKED_IPS is reached. The
+# buckets are mutable lists reused in place, so steady-state traffic
+# from a known IP allocates nothing.
+download_requests = OrderedDict()
+download_requests_lock = threading.Lock()
+MAX_REQUESTS_PER_IP = int(os.environ.get('MAX_REQUESTS_PER_IP', '10'))
+RATE_LIMIT_WINDOW_MINUTES = int(os.environ.get('RATE_LIMIT_WINDOW_MINUTES', '60'))
+RATE_LIMIT_WINDOW_SECONDS = RATE_LIMIT_WINDOW_MINUTES * 60
+MAX_TRACKED_IPS = int(os.environ.get('MAX_TRACKED_IPS', '10000'))
+# Roughly 1 in 1024 rate-limit checks also prunes stale entries, so the
+# map stays trimmed between the janitor's 5-minute sweeps.
+_rate_limit_counter = itertools.count()
+
+# Background download jobs: POST /download enqueues here and returns a
+# job id immediately; GET /jobs/<id> polls progress. Insertion-ordered
+# so the oldest job can be evicted once MAX_TRACKED_JOBS is reached.
+# Downloads run in subprocesses: yt-dlp's extractor parsing and
+# signature decryption are GIL-bound, so a thread pool would serialize
+# the CPU work of concurrent downloads, and a crashed extractor can't
+# take the web process down with it. forkserver keeps spawning safe
+# alongside Gunicorn's threads.
+def _new_download_pool():
+    return ProcessPoolExecutor(
+        max_workers=int(os.environ.get('DOWNLOAD_WORKERS', '4')),
+        mp_context=mp.get_context('forkserver'),
+    )
+
+DOWNLOAD_POOL = _new_download_pool()
+_download_pool_lock = threading.Lock()
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+MAX_TRACKED_JOBS = int(os.environ.get('MAX_TRACKED_JOBS', '1000'))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_HOURS', '6')) * 3600
+
+# Single-flight dedup: concurrent requests for the same URL coalesce
+# onto one job, and recently completed downloads are answered from disk
+# without re-running yt-dlp. Both maps are keyed by the URL hash.
+inflight_urls = {}
+recent_results = OrderedDict()
+RECENT_RESULTS_MAX = 256
+inflight_lock = threading.Lock()
+
+# Per-job progress queues feeding the SSE stream endpoint. Bounded so a
+# slow or absent consumer can't accumulate unread events.
+PROGRESS_QUEUE_DEPTH = 100
+_progress_queues = {}
+_progress_queues_lock = threading.Lock()
+
+# Only YouTube URLs are accepted; rejecting everything else up front
+# avoids running the whole yt-dlp extractor chain on junk input.
+YOUTUBE_URL_RE = re.compile(
+    r'^https?://(?:www\.|m\.)?(?:youtube\.com/(?:watch\?|shorts/)|youtu\.be/)',
+    re.IGNORECASE
+)
+
+# Below this many files a single thread finishes faster than the pool
+# spin-up; above it, striping the stat+unlink work across threads helps
+# because both release the GIL.
+CLEANUP_PARALLEL_THRESHOLD = 256
+
+def _cleanup_stripe(entries, cutoff):
+    """Remove expired files from one stripe of directory entries"""
+    for i, entry in enumerate(entries):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                logger.info(f"Cleaned up old file: {entry.path}")
+        except OSError as e:
+            logger.error(f"Failed to remove file {entry.path}: {e}")
+        if i % 100 == 99:
+            time.sleep(0.1)  # Yield some I/O bandwidth to live downloads
+
+def cleanup_old_files():
+    """Clean up files older than MAX_FILE_AGE_HOURS"""
+    try:
+        cutoff = time.time() - MAX_FILE_AGE_HOURS * 3600
+
+        # Single scandir pass: is_file() and stat() are served from the
+        # directory entry cache, avoiding extra stat syscalls per file.
+        with os.scandir(DOWNLOAD_DIR) as it:
+            entries = [e for e in it if e.is_file(follow_symlinks=False)]
+
+        if len(entries) < CLEANUP_PARALLEL_THRESHOLD:
+            _cleanup_stripe(entries, cutoff)
+        else:
+            workers = min(4, os.cpu_count() or 1)
+            stripes = [entries[i::workers] for i in range(workers)]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for stripe in stripes:
+                    pool.submit(_cleanup_stripe, stripe, cutoff)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error during cleanup: {e}")
+
+def _sweep_rate_limiter_locked():
+    """Drop idle rate-limit entries; caller must hold download_requests_lock"""
+    cutoff = time.monotonic() - 2 * RATE_LIMIT_WINDOW_SECONDS
+    stale_ips = [
+        ip for ip, (_, window_start) in download_requests.items()
+        if window_start < cutoff
+    ]
+    for ip in stale_ips:
+        del download_requests[ip]
+    return len(stale_ips)
+
+def sweep_rate_limiter():
+    """Drop rate-limit entries that have been idle for more than two windows"""
+    with download_requests_lock:
+        swept = _sweep_rate_limiter_locked()
+    if swept:
+        logger.info(f"Swept {swept} idle rate-limit entries")
+
+def sweep_jobs():
+    """Drop finished jobs older than JOB_RETENTION_SECONDS"""
+    cutoff = time.monotonic() - JOB_RETENTION_SECONDS
+    with jobs_lock:
+        stale_ids = [
+            job_id for job_id, job in jobs.items()
+            if job.get("_finished_monotonic") is not None and job["_finished_monotonic"] < cutoff
+        ]
+        for job_id in stale_ids:
+            del jobs[job_id]
+    if stale_ids:
+        logger.info(f"Swept {len(stale_ids)} finished jobs")
+
+def start_sweep_thread():
+    """Start the per-process sweeper for this worker's own dicts
+
+    Runs in every process regardless of the file-cleanup lock: the
+    rate-limit and job maps are per-process state, so each worker has
+    to prune its own.
+    """
+    def sweep_worker():
+        while True:
+            time.sleep(300)  # Wake every 5 minutes
+            sweep_rate_limiter()
+            sweep_jobs()
+
+    sweep_thread = threading.Thread(target=sweep_worker, daemon=True)
+    sweep_thread.start()
+    logger.info("Started sweep background thread")
+
+def start_cleanup_thread():
+    """Start background thread for periodic file cleanup"""
+    def cleanup_worker():
+        while True:
+            cleanup_old_files()
+            time.sleep(3600)  # Run every hour
+
+    cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
+    cleanup_thread.start()
+    logger.info("Started cleanup background thread")
+
+def check_rate_limit(client_ip):
+    """Token-bucket rate limiting check (O(1) per request, bounded memory)"""
+    now = time.monotonic()
+    with download_requests_lock:
+        if next(_rate_limit_counter) & 1023 == 0:
+            _sweep_rate_limiter_locked()
+        entry = download_requests.get(client_ip)
+
+        if entry is None:
+            if len(download_requests) >= MAX_TRACKED_IPS:
+                download_requests.popitem(last=False)  # Evict least-recently-seen IP
+            download_requests[client_ip] = [1, now]
+            return True
+
+        if now - entry[1] >= RATE_LIMIT_WINDOW_SECONDS:
+            # Expired window: reset the existing bucket in place
+            entry[0] = 1
+            entry[1] = now
+            download_requests.move_to_end(client_ip)
+            return True
+
+        if entry[0] >= MAX_REQUESTS_PER_IP:
+            return False
+
+        entry[0] += 1
+        download_requests.move_to_end(client_ip)
+        return True
+
+# Cache the /status disk/file-count snapshot so frequent polling doesn't
+# trigger a full directory scan on every hit.
+STATUS_CACHE_TTL_SECONDS = 5.0
+_status_cache = {"ts": 0.0, "data": None}
+_status_cache_lock = threading.Lock()
+
+def _get_status_snapshot():
+    """Return (file_count, disk_usage) refreshed at most every few seconds"""
+    now = time.monotonic()
+    with _status_cache_lock:
+        if _status_cache["data"] is not None and now - _status_cache["ts"] < STATUS_CACHE_TTL_SECONDS:
+            return _status_cache["data"]
+
+        # Attempt directly instead of stat-ing for existence first: one
+        # syscall on the common path and no TOCTOU window.
+        try:
+            disk_usage = os.statvfs(DOWNLOAD_DIR)
+            with os.scandir(DOWNLOAD_DIR) as entries:
+                file_count = sum(1 for _ in entries)
+        except FileNotFoundError:
+            disk_usage = None
+            file_count = 0
+
+        _status_cache["ts"] = now
+        _status_cache["data"] = (file_count, disk_usage)
+        return _status_cache["data"]
+
+# Precompiled at import: one C-level substitution pass each for unsafe
+# characters and whitespace runs.
+_UNSAFE_FILENAME_RE = re.compile(r'[^A-Za-z0-9\-_. ]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def get_safe_filename(title):
+    """Generate a safe filename from video title"""
+    return _WHITESPACE_RE.sub(' ', _UNSAFE_FILENAME_RE.sub('_', title)).strip()[:100]
+
+def create_job():
+    """Register a new download job and return its id"""
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "status": "queued",
+        "title": None,
+        "uploader": None,
+        "duration": None,
+        "filename": None,
+        "file_size_bytes": None,
+        "error": None,
+        "_created_ts": time.time(),  # Epoch floats internally; ISO-formatted
+        "_finished_ts": None,        # only when a snapshot is served
+        "_finished_monotonic": None,  # Internal, used by sweep_jobs
+    }
+    with jobs_lock:
+        if len(jobs) >= MAX_TRACKED_JOBS:
+            jobs.popitem(last=False)  # Evict the oldest tracked job
+        jobs[job_id] = job
+    return job_id
+
+def update_job(job_id, **fields):
+    """Update fields on a tracked job (no-op if it was evicted)"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+def get_job(job_id):
+    """Return a snapshot of a tracked job (minus internal fields), or None"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = {k: v for k, v in job.items() if not k.startswith('_')}
+        created_ts = job["_created_ts"]
+        finished_ts = job["_finished_ts"]
+    # Human-readable timestamps are rendered here, at response time,
+    # instead of allocating datetime objects on the worker paths
+    snapshot["created_at"] = datetime.fromtimestamp(created_ts).isoformat()
+    snapshot["finished_at"] = (
+        datetime.fromtimestamp(finished_ts).isoformat() if finished_ts is not None else None
+    )
+    return snapshot
+
+def _get_progress_queue(job_id, create=False):
+    """Return the progress queue for a job, optionally creating it"""
+    with _progress_queues_lock:
+        q = _progress_queues.get(job_id)
+        if q is None and create:
+            q = queue.Queue(maxsize=PROGRESS_QUEUE_DEPTH)
+            _progress_queues[job_id] = q
+        return q
+
+def _publish_progress(job_id, event):
+    """Push a progress event to any subscribed stream, dropping if full"""
+    q = _get_progress_queue(job_id)
+    if q is None:
+        return
+    try:
+        q.put_nowait(event)
+    except queue.Full:
+        pass  # Slow consumer; newer events matter more than old ones
+
+def _finish_progress(job_id, event):
+    """Publish a terminal event and detach the job's progress queue"""
+    _publish_progress(job_id, event)
+    with _progress_queues_lock:
+        _progress_queues.pop(job_id, None)
+
+def _url_key(url):
+    """Hash key for single-flight and result caching"""
+    return hashlib.sha1(url.strip().encode()).hexdigest()
+
+# Progress events cross the process boundary through a manager queue,
+# drained by a single thread into the in-process SSE queues. Created
+# lazily so pool subprocesses importing this module don't spawn their
+# own manager process.
+_mp_progress_queue = None
+_mp_progress_lock = threading.Lock()
+
+def _get_mp_progress_queue():
+    global _mp_progress_queue
+    with _mp_progress_lock:
+        if _mp_progress_queue is None:
+            # Same forkserver context as the pool: a default fork from
+            # this multithreaded worker wouldn't be fork-safe
+            _mp_progress_queue = mp.get_context('forkserver').Manager().Queue()
+            drain = threading.Thread(
+                target=_drain_progress_events, args=(_mp_progress_queue,), daemon=True
+            )
+            drain.start()
+        return _mp_progress_queue
+
+def _drain_progress_events(progress_queue):
+    """Relay subprocess progress events into the per-job SSE queues"""
+    while True:
+        try:
+            job_id, event = progress_queue.get()
+        except (EOFError, OSError):
+            return
+        job = get_job(job_id)
+        if job is not None and job["status"] == "queued":
+            update_job(job_id, status="downloading")
+        _publish_progress(job_id, event)
+
+def _download_worker(job_id, url, download_dir, max_duration, progress_queue):
+    """Download one video; runs inside a DOWNLOAD_POOL subprocess.
+
+    Must stay top-level and return only picklable data. All job-state
+    bookkeeping happens in the web process via _finalize_download.
+    """
+    def progress_hook(d):
+        try:
+            progress_queue.put((job_id, {
+                "status": d.get('status'),
+                "downloaded_bytes": d.get('downloaded_bytes'),
+                "total_bytes": d.get('total_bytes') or d.get('total_bytes_estimate'),
+                "eta": d.get('eta'),
+            }))
+        except Exception:
+            pass  # Progress is best-effort; never fail the download over it
+
+    # Duration gating happens inside the single download call: yt-dlp
+    # invokes this filter on the fetched metadata and skips the byte
+    # transfer when it returns a rejection message. This halves the
+    # metadata round-trips compared to a separate preflight extract.
+    rejected = {}
+
+    def duration_filter(info, *, incomplete=False):
+        duration = info.get('duration')
+        if duration and duration > max_duration:
+            rejected["error"] = (
+                f"Video duration {duration}s exceeds maximum {max_duration}s"
+            )
+            rejected["title"] = info.get('title')
+            rejected["duration"] = duration
+            return rejected["error"]
+        return None
+
+    ydl_opts = {
+        'outtmpl': f'{download_dir}/%(title)s.%(ext)s',
+        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'extractaudio': False,
+        'writeinfojson': False,
+        'writethumbnail': False,
+        'match_filter': duration_filter,
+        'progress_hooks': [progress_hook],
+    }
+
+    try:
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            filename = ydl.prepare_filename(info) if info else None
+    except Exception:
+        return {"status": "failed", "error": "Failed to download video file"}
+
+    if rejected:
+        return {"status": "rejected", **rejected}
+
+    if info is None or filename is None:
+        return {"status": "failed", "error": "Invalid URL or video not accessible"}
+
+    return {
+        "status": "completed",
+        "title": info.get('title', 'Unknown'),
+        "uploader": info.get('uploader', 'Unknown'),
+        "duration": info.get('duration', 0),
+        "filename": filename,
+    }
+
+def _submit_download(job_id, url):
+    """Send a job to the download pool and hook up its completion"""
+    global DOWNLOAD_POOL
+    args = (_download_worker, job_id, url,
+            DOWNLOAD_DIR, MAX_DURATION_SECONDS, _get_mp_progress_queue())
+    with _download_pool_lock:
+        try:
+            future = DOWNLOAD_POOL.submit(*args)
+        except BrokenProcessPool:
+            # An abruptly killed child (e.g. OOM) permanently breaks the
+            # executor; replace it so one crash can't disable downloads
+            logger.warning("Download pool broken, rebuilding")
+            DOWNLOAD_POOL = _new_download_pool()
+            future = DOWNLOAD_POOL.submit(*args)
+    future.add_done_callback(lambda f: _finalize_download(job_id, url, f))
+
+def _finalize_download(job_id, url, future):
+    """Record a finished worker's result and clear the inflight slot"""
+    try:
+        try:
+            result = future.result()
+        except Exception as e:
+            # Covers crashed subprocesses (BrokenProcessPool) as well
+            logger.error(f"Download failed for job {job_id}: {e}")
+            result = {"status": "failed", "error": "Failed to download video file"}
+
+        if result["status"] == "rejected":
+            logger.warning(f"Job {job_id} rejected: {result['error']}")
+            update_job(
+                job_id,
+                status="failed",
+                title=result.get("title"),
+                duration=result.get("duration"),
+                error=result["error"],
+                _finished_ts=time.time(),
+                _finished_monotonic=time.monotonic(),
+            )
+            _finish_progress(job_id, {"status": "failed", "error": result["error"]})
+            return
+
+        if result["status"] == "failed":
+            logger.error(f"Job {job_id} failed: {result['error']}")
+            update_job(
+                job_id,
+                status="failed",
+                error=result["error"],
+                _finished_ts=time.time(),
+                _finished_monotonic=time.monotonic(),
+            )
+            _finish_progress(job_id, {"status": "failed", "error": result["error"]})
+            return
+
+        title = result["title"]
+        filename = result["filename"]
+
+        # Rename to the API's safe-filename convention (yt-dlp applies
+        # its own sanitization to the template, which differs from ours)
+        safe_path = os.path.join(
+            DOWNLOAD_DIR, get_safe_filename(title) + os.path.splitext(filename)[1]
+        )
+        if filename != safe_path:
+            try:
+                os.replace(filename, safe_path)
+                filename = safe_path
+            except OSError as e:
+                logger.error(f"Failed to rename {filename}: {e}")
+
+        logger.info(f"Download complete: {filename}")
+        try:
+            file_size_bytes = os.stat(filename).st_size
+        except OSError:
+            file_size_bytes = None
+        update_job(
+            job_id,
+            status="completed",
+            title=title,
+            uploader=result["uploader"],
+            duration=result["duration"],
+            filename=os.path.basename(filename),
+            file_size_bytes=file_size_bytes,
+            _finished_ts=time.time(),
+            _finished_monotonic=time.monotonic(),
+        )
+        _finish_progress(job_id, {"status": "completed", "filename": os.path.basename(filename)})
+
+        # Remember the result so repeat requests can be served from disk
+        key = _url_key(url)
+        with inflight_lock:
+            if len(recent_results) >= RECENT_RESULTS_MAX:
+                recent_results.popitem(last=False)
+            recent_results[key] = job_id
+    finally:
+        key = _url_key(url)
+        with inflight_lock:
+            if inflight_urls.get(key) == job_id:
+                del inflight_urls[key]
+
+# Health check endpoint
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify({
+        "status": "healthy", 
+        "service": "youtube-downloader",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "download_dir": DOWNLOAD_DIR,
+        "max_duration": MAX_DURATION_SECONDS
+    })
+
+# Root endpoint with documentation
+@app.route('/', methods=['GET'])
+def home():
+    return jsonify({
+        "message": "YouTube Downloader API",
+        "version": "1.1.0",
+        "endpoints": {
+            "GET /health": "Health check",
+            "POST /download": "Queue a YouTube video download, returns a job id",
+            "GET /jobs/<job_id>": "Poll download job status",
+            "GET /jobs/<job_id>/stream": "Stream download progress (SSE)",
+            "GET /files/<job_id>": "Fetch a completed download",
+            "GET /status": "Service status and configuration"
+        },
+        "limits": {
+            "max_duration_seconds": MAX_DURATION_SECONDS,
+            "max_requests_per_ip": MAX_REQUESTS_PER_IP,
+            "rate_limit_window_minutes": RATE_LIMIT_WINDOW_MINUTES
+        }
+    })
+
+# Status endpoint
+@app.route('/status', methods=['GET'])
+def status():
+    try:
+        file_count, disk_usage = _get_status_snapshot()
+
+        return jsonify({
+            "service": "youtube-downloader",
+            "status": "running",
+            "download_directory": DOWNLOAD_DIR,
+            "file_count": file_count,
+            "disk_usage": {
+                "total_bytes": disk_usage.f_frsize * disk_usage.f_blocks if disk_usage else None,
+                "free_bytes": disk_usage.f_frsize * disk_usage.f_bavail if disk_usage else None
+            } if disk_usage else None,
+            "configuration": {
+                "max_duration_seconds": MAX_DURATION_SECONDS,
+                "max_file_age_hours": MAX_FILE_AGE_HOURS,
+                "max_requests_per_ip": MAX_REQUESTS_PER_IP,
+                "rate_limit_window_minutes": RATE_LIMIT_WINDOW_MINUTES
+            }
+        })
+    except Exception as e:
+        logger.error(f"Status check failed: {e}")
+        return jsonify({"error": "Status check failed", "details": str(e)}), 500
+
+# Download endpoint
+@app.route('/download', methods=['POST'])
+def download_video():
+    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+    
+    # Rate limiting check
+    if not check_rate_limit(client_ip):
+        logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+        return jsonify({
+            "error": "Rate limit exceeded",
+            "message": f"Maximum {MAX_REQUESTS_PER_IP} requests per {RATE_LIMIT_WINDOW_MINUTES} minutes"
+        }), 429
+    
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON data"}), 400
+        
+    url = data.get("url")
+    if not url:
+        logger.error("No URL provided")
+        return jsonify({"error": "No URL provided"}), 400
+
+    # Reject non-YouTube URLs before touching yt-dlp
+    if not YOUTUBE_URL_RE.match(url):
+        return jsonify({"error": "Unsupported URL", "details": "Only YouTube URLs are accepted"}), 400
+
+    try:
+        key = _url_key(url)
+        with inflight_lock:
+            # Coalesce onto an already-running job for the same URL
+            inflight_id = inflight_urls.get(key)
+            if inflight_id is not None:
+                job = get_job(inflight_id)
+                if job is not None and job["status"] in ("queued", "downloading"):
+                    logger.info(f"Coalesced request onto job {inflight_id}: {url}")
+                    return jsonify({
+                        "job_id": inflight_id,
+                        "status": job["status"],
+                        "deduplicated": True
+                    }), 202
+
+            # Serve recently completed downloads straight from disk
+            recent_id = recent_results.get(key)
+            if recent_id is not None:
+                job = get_job(recent_id)
+                if (job is not None and job["status"] == "completed" and job["filename"]
+                        and os.path.exists(os.path.join(DOWNLOAD_DIR, job["filename"]))):
+                    recent_results.move_to_end(key)
+                    logger.info(f"Served cached result {recent_id}: {url}")
+                    return jsonify({
+                        "job_id": recent_id,
+                        "status": "completed",
+                        "cached": True
+                    }), 200
+                recent_results.pop(key, None)  # Job or file is gone
+
+            # Queue a fresh download; metadata fetch and duration gating
+            # happen inside the worker's single yt-dlp call
+            job_id = create_job()
+            inflight_urls[key] = job_id
+
+        try:
+            _submit_download(job_id, url)
+        except Exception:
+            # Couldn't reach the pool (broken executor, Manager spawn
+            # failure): fail the job and free the URL, otherwise later
+            # requests coalesce onto a forever-queued zombie
+            update_job(
+                job_id,
+                status="failed",
+                error="Failed to start download",
+                _finished_ts=time.time(),
+                _finished_monotonic=time.monotonic(),
+            )
+            _finish_progress(job_id, {"status": "failed", "error": "Failed to start download"})
+            with inflight_lock:
+                if inflight_urls.get(key) == job_id:
+                    del inflight_urls[key]
+            raise
+
+        logger.info(f"Queued download job {job_id}: {url}")
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+    except Exception as e:
+        logger.error(f"Unexpected error during download: {str(e)}")
+        return jsonify({
+            "error": "Internal server error",
+            "details": "An unexpected error occurred during download"
+        }), 500
+
+# Job status endpoint
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+# Live progress stream: pushes yt-dlp progress events as server-sent
+# events, so clients don't need to poll /jobs/<id> every second.
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job["status"] in ("completed", "failed"):
+        # Already finished: emit the final state once and close
+        def finished():
+            yield f"data: {orjson.dumps(job).decode()}\n\n"
+        return Response(finished(), mimetype='text/event-stream')
+
+    progress_queue = _get_progress_queue(job_id, create=True)
+
+    def generate():
+        while True:
+            try:
+                event = progress_queue.get(timeout=30)
+            except queue.Empty:
+                # Re-check the job in case the terminal event was missed
+                current = get_job(job_id)
+                if current is None or current["status"] in ("completed", "failed"):
+                    if current is not None:
+                        yield f"data: {orjson.dumps(current).decode()}\n\n"
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {orjson.dumps(event).decode()}\n\n"
+            if event.get("status") in ("completed", "failed"):
+                return
+
+    return Response(generate(), mimetype='text/event-stream')
+
+# File retrieval endpoint; send_from_directory streams via the WSGI
+# file wrapper, so Gunicorn can serve the bytes with sendfile(2)
+# instead of a Python read/write loop.
+@app.route('/files/<job_id>', methods=['GET'])
+def get_file(job_id):
+    job = get_job(job_id)
+    if job is None or job["status"] != "completed" or not job["filename"]:
+        return jsonify({"error": "File not available"}), 404
+    return send_from_directory(DOWNLOAD_DIR, job["filename"], as_attachment=True)
+
+CLEANUP_LOCK_FILE = os.environ.get('CLEANUP_LOCK_FILE', '/tmp/ytubeddd_cleanup.lock')
+
+def _start_cleanup_if_first_worker():
+    """Spawn the file janitor in only one process via a non-blocking lock
+
+    Under Gunicorn without preload every worker imports this module; an
+    exclusive flock held for the process lifetime ensures a single
+    cleanup thread instead of N workers racing to unlink the same
+    files. Only the shared-filesystem cleanup needs this guard — the
+    in-memory sweeps run per process via start_sweep_thread.
+    """
+    lock_fd = os.open(CLEANUP_LOCK_FILE, os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        logger.info("Cleanup thread already running in another worker")
+        return
+    atexit.register(lambda: (fcntl.flock(lock_fd, fcntl.LOCK_UN), os.close(lock_fd)))
+    start_cleanup_thread()
+
+# Initialize background threads when app starts: every process sweeps
+# its own in-memory state, one process cleans the shared filesystem
+start_sweep_thread()
+_start_cleanup_if_first_worker()
+